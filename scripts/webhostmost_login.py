@@ -7,7 +7,11 @@ and relies on credentials passed via environment variables.
 
 from __future__ import annotations
 
+import contextlib
+import json
 import os
+import random
+import re
 import sys
 import time
 from typing import Iterable, Optional
@@ -17,10 +21,92 @@ from playwright.sync_api import sync_playwright
 
 LOGIN_URL = "https://client.webhostmost.com/clientarea.php"
 CLOUDFLARE_TIMEOUT_SECONDS = 30
-CLOUDFLARE_POLL_INTERVAL_SECONDS = 2
+CLOUDFLARE_POLL_INTERVAL_MS = 500
 MAX_ATTEMPTS = 3
 TWO_FACTOR_EXIT_CODE = 2
 TRANSIENT_EXIT_CODE = 3
+STORAGE_STATE_PATH = os.environ.get("WEBHOSTMOST_STORAGE", "/tmp/whm_state.json")
+PROFILE_DIR = os.environ.get("WEBHOSTMOST_PROFILE", "/tmp/whm_profile")
+
+USERNAME_SELECTORS = (
+    "input[name='username']",
+    "input[name='email']",
+    "#inputEmail",
+    "input[type='email']",
+)
+PASSWORD_SELECTORS = (
+    "input[name='password']",
+    "#inputPassword",
+    "input[type='password']",
+)
+SUBMIT_SELECTORS = (
+    "button[type='submit']",
+    "button#login",
+    "text=Login",
+)
+TWO_FACTOR_SELECTORS = (
+    "input[name*='twofactor']",
+    "input[name*='2fa']",
+    "input[id*='twofactor']",
+    "input[id*='2fa']",
+    "input[name='token']",
+    "input[name='code']",
+)
+CAPTCHA_SELECTORS = (
+    "iframe[src*='recaptcha']",
+    "iframe[src*='hcaptcha']",
+    "div.g-recaptcha",
+    "div.h-captcha",
+)
+CHALLENGE_SELECTORS = list(TWO_FACTOR_SELECTORS + CAPTCHA_SELECTORS)
+ENGINE_SELECTOR_PATTERN = re.compile(r"^[a-z_-]+=")
+TWO_FACTOR_TEXT_PATTERN = re.compile(
+    "|".join(map(re.escape, ("two-factor", "verification code")))
+)
+
+CHROME_ARGS = [
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--disable-default-apps",
+    "--disable-features=Translate,BackForwardCache,AcceptCHFrame,"
+    "AvoidUnnecessaryBeforeUnloadCheckSync",
+]
+
+# Matched against request URLs so that only blocked requests reach Python;
+# documents, scripts, XHR and stylesheets are never routed. Stylesheets must
+# load for the visibility checks to see what the user would see.
+BLOCKED_URL_PATTERN = re.compile(
+    r"\.(?:png|jpe?g|gif|webp|svg|ico|woff2?|ttf|otf|eot|mp3|mp4|webm)(?:[?#]|$)"
+    r"|google-analytics|googletagmanager|doubleclick|hotjar",
+    re.IGNORECASE,
+)
+
+CLOUDFLARE_CLEARED_JS = """() => {
+    const text = (document.body?.innerText || "").toLowerCase();
+    return ![
+        "checking your browser",
+        "just a moment",
+        "please stand by",
+        "ddos protection by cloudflare",
+    ].some((indicator) => text.includes(indicator));
+}"""
+LOGOUT_PRESENT_JS = """() =>
+    !!document.querySelector("a[href*='logout'], [data-logout]")
+    || /log\\s*out/i.test(document.body?.innerText || "")"""
+LOGIN_READY_JS = """() => {
+    const visible = (el) =>
+        el.getClientRects().length > 0 && getComputedStyle(el).visibility !== "hidden";
+    const any = (sel) => [...document.querySelectorAll(sel)].some(visible);
+    if (any("a[href*='logout']")) return "session";
+    if (any("input[type='password']")) return "login";
+    return false;
+}"""
+BODY_SNIPPET_JS = (
+    "() => (document.body?.innerText || '').slice(0, 4096).toLowerCase()"
+)
+SELECTOR_PRESENCE_JS = "(sels) => sels.map((s) => !!document.querySelector(s))"
 
 
 class TwoFactorOrCaptchaDetected(Exception):
@@ -48,18 +134,21 @@ def main() -> int:
         return 1
 
     try:
-        with sync_playwright() as playwright:
-            browser = playwright.chromium.launch(headless=True)
-            try:
-                context = None
-                try:
-                    context = browser.new_context()
-                    attempt_login_with_retries(context, email, password)
-                finally:
-                    if context is not None:
-                        context.close()
-            finally:
-                browser.close()
+        with contextlib.ExitStack() as stack:
+            playwright = stack.enter_context(sync_playwright())
+            context = stack.enter_context(
+                playwright.chromium.launch_persistent_context(
+                    user_data_dir=PROFILE_DIR,
+                    headless=True,
+                    args=CHROME_ARGS,
+                    chromium_sandbox=False,
+                    ignore_default_args=["--enable-automation"],
+                )
+            )
+            restore_storage_state(context)
+            context.route(BLOCKED_URL_PATTERN, block_unneeded_resources)
+            attempt_login_with_retries(context, email, password)
+            save_storage_state(context)
     except TwoFactorOrCaptchaDetected as exc:
         print(str(exc), file=sys.stderr)
         return TWO_FACTOR_EXIT_CODE
@@ -74,75 +163,90 @@ def main() -> int:
     return 0
 
 
+def block_unneeded_resources(route) -> None:
+    """Abort subresources that the login form does not need."""
+    route.abort()
+
+
+def restore_storage_state(context) -> None:
+    """Load cookies saved by a previous run into the persistent profile."""
+    if not os.path.exists(STORAGE_STATE_PATH):
+        return
+    try:
+        with open(STORAGE_STATE_PATH, encoding="utf-8") as handle:
+            cookies = json.load(handle).get("cookies", [])
+        if cookies:
+            context.add_cookies(cookies)
+    except Exception as exc:  # noqa: BLE001
+        print(f"Unable to restore session state: {exc}", file=sys.stderr)
+
+
+def save_storage_state(context) -> None:
+    """Persist session cookies so the next run can skip the login form."""
+    try:
+        context.storage_state(path=STORAGE_STATE_PATH)
+    except Exception as exc:  # noqa: BLE001
+        print(f"Unable to save session state: {exc}", file=sys.stderr)
+
+
 def attempt_login_with_retries(context, email: str, password: str) -> None:
     """Attempt the login flow, retrying transient failures a limited number of times."""
     last_error: Optional[Exception] = None
+    # A persistent context starts with a blank page; reuse it for every attempt
+    # and let the context close it.
+    page = context.pages[0] if context.pages else context.new_page()
 
     for attempt in range(1, MAX_ATTEMPTS + 1):
-        page = context.new_page()
         try:
+            if navigate_to_login(page):
+                # A restored session already reached the client area.
+                return
             perform_login_flow(page, email, password)
-            page.close()
             return
         except TransientPageState as exc:
             last_error = exc
-        except Exception:
-            page.close()
-            raise
-        page.close()
         if attempt < MAX_ATTEMPTS:
-            time.sleep(3)
+            time.sleep(retry_delay(attempt))
 
     if last_error is not None:
         raise last_error
     raise RuntimeError("Login attempts exhausted without success.")
 
 
-def perform_login_flow(page, email: str, password: str) -> None:
-    navigate_to_login(page)
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter: roughly 0.5 s, 1 s, 2 s, ... capped at 10 s."""
+    return min(0.5 * (2 ** (attempt - 1)), 10) + random.random() * 0.5
 
+
+def perform_login_flow(page, email: str, password: str) -> None:
     if message := detect_twofactor_or_captcha(page):
         raise TwoFactorOrCaptchaDetected(message)
 
     if not fill_first_available_field(
         page,
-        (
-            "input[name='username']",
-            "input[name='email']",
-            "#inputEmail",
-            "input[type='email']",
-        ),
+        USERNAME_SELECTORS,
         email,
     ):
         raise RuntimeError("Unable to locate username/email input field.")
 
     if not fill_first_available_field(
         page,
-        (
-            "input[name='password']",
-            "#inputPassword",
-            "input[type='password']",
-        ),
+        PASSWORD_SELECTORS,
         password,
     ):
         raise RuntimeError("Unable to locate password input field.")
 
-    if not click_first_available(
-        page,
-        (
-            "button[type='submit']",
-            "button#login",
-            "text=Login",
-        ),
-    ):
+    submit = find_first_visible(page, SUBMIT_SELECTORS)
+    if submit is None:
         raise RuntimeError("Unable to locate login submit button.")
 
-    # Give the page a moment to navigate and load.
+    # The login form is served from a client-area URL, so wait for the
+    # navigation the submit triggers rather than for a URL we may already be on.
     try:
-        page.wait_for_load_state("networkidle", timeout=15_000)
-    except PlaywrightTimeoutError:
-        # Not fatal; we will continue to verification and challenges detection.
-        pass
+        with page.expect_navigation(wait_until="domcontentloaded", timeout=15_000):
+            submit.click()
+    except PlaywrightTimeoutError as exc:
+        raise TransientPageState("Login form submission did not navigate.") from exc
 
     wait_for_cloudflare(page)
 
@@ -153,137 +257,118 @@ def perform_login_flow(page, email: str, password: str) -> None:
         raise RuntimeError("Login verification failed.")
 
 
-def navigate_to_login(page) -> None:
+def navigate_to_login(page) -> bool:
+    """Open the login page and return True if a restored session skipped the form."""
     try:
-        page.goto(LOGIN_URL, wait_until="domcontentloaded", timeout=30_000)
+        page.goto(LOGIN_URL, wait_until="commit", timeout=30_000)
     except PlaywrightTimeoutError as exc:
         raise TransientPageState("Timed out navigating to login page.") from exc
 
-    wait_for_cloudflare(page)
+    # The login form (or a restored session's logout link) only renders once
+    # any Cloudflare interstitial has cleared, so waiting for it covers both.
+    try:
+        ready = page.wait_for_function(
+            LOGIN_READY_JS, timeout=CLOUDFLARE_TIMEOUT_SECONDS * 1_000
+        )
+    except PlaywrightTimeoutError as exc:
+        raise TransientPageState("Login form did not appear within timeout.") from exc
+    return ready.json_value() == "session"
 
 
 def wait_for_cloudflare(page) -> None:
-    deadline = time.time() + CLOUDFLARE_TIMEOUT_SECONDS
-    while time.time() < deadline:
-        if not has_cloudflare_interstitial(page):
-            return
-        page.wait_for_timeout(CLOUDFLARE_POLL_INTERVAL_SECONDS * 1_000)
-    raise TransientPageState("Cloudflare interstitial did not clear within timeout.")
+    try:
+        page.wait_for_function(
+            CLOUDFLARE_CLEARED_JS,
+            timeout=CLOUDFLARE_TIMEOUT_SECONDS * 1_000,
+            polling=CLOUDFLARE_POLL_INTERVAL_MS,
+        )
+    except PlaywrightTimeoutError as exc:
+        raise TransientPageState(
+            "Cloudflare interstitial did not clear within timeout."
+        ) from exc
 
 
-def has_cloudflare_interstitial(page) -> bool:
+def fill_first_available_field(page, selectors: Iterable[str], value: str) -> bool:
+    target = find_first_visible(page, selectors)
+    if target is None:
+        return False
     try:
-        body_text = page.text_content("body", timeout=2_000) or ""
-    except PlaywrightTimeoutError:
+        target.fill(value)
+    except Exception:
         return False
+    return True
 
-    lowered = body_text.lower()
-    indicators = (
-        "checking your browser",
-        "just a moment",
-        "please stand by",
-        "ddos protection by cloudflare",
-    )
-    return any(indicator in lowered for indicator in indicators)
 
+def find_first_visible(page, selectors: Iterable[str]):
+    """Return the first visible match, querying all CSS selectors at once.
 
-def fill_first_available_field(page, selectors: Iterable[str], value: str) -> bool:
+    Hidden matches are filtered out before picking the first element, so an
+    unrelated hidden input earlier in the DOM cannot shadow the real one.
+    Playwright engine selectors such as ``text=Login`` cannot be joined into a
+    CSS list, so they are tried one by one after the combined CSS query.
+    """
+    css_selectors = []
+    engine_selectors = []
     for selector in selectors:
-        locator = page.locator(selector)
-        try:
-            if locator.count() == 0:
-                continue
-            target = locator.first
-            target.wait_for(state="visible", timeout=5_000)
-            target.fill(value)
-            return True
-        except PlaywrightTimeoutError:
-            continue
-        except Exception:
-            continue
-    return False
+        if ENGINE_SELECTOR_PATTERN.match(selector):
+            engine_selectors.append(selector)
+        else:
+            css_selectors.append(selector)
 
+    candidates = engine_selectors
+    if css_selectors:
+        candidates = [", ".join(css_selectors)] + engine_selectors
 
-def click_first_available(page, selectors: Iterable[str]) -> bool:
-    for selector in selectors:
-        locator = page.locator(selector)
+    for selector in candidates:
+        target = page.locator(selector).locator("visible=true").first
         try:
-            if locator.count() == 0:
-                continue
-            target = locator.first
             target.wait_for(state="visible", timeout=5_000)
-            target.click()
-            return True
+            return target
         except PlaywrightTimeoutError:
             continue
         except Exception:
             continue
-    return False
+    return None
 
 
 def detect_twofactor_or_captcha(page) -> Optional[str]:
-    twofactor_selectors = (
-        "input[name*='twofactor']",
-        "input[name*='2fa']",
-        "input[id*='twofactor']",
-        "input[id*='2fa']",
-        "input[name='token']",
-        "input[name='code']",
-    )
-    captcha_selectors = (
-        "iframe[src*='recaptcha']",
-        "iframe[src*='hcaptcha']",
-        "div.g-recaptcha",
-        "div.h-captcha",
-    )
-
-    for selector in twofactor_selectors:
-        try:
-            if page.locator(selector).count() > 0:
-                return "Two-factor authentication challenge detected."
-        except Exception:
-            continue
-
-    for selector in captcha_selectors:
-        try:
-            if page.locator(selector).count() > 0:
-                return "CAPTCHA challenge detected."
-        except Exception:
-            continue
-
     try:
-        body_text = page.text_content("body", timeout=2_000) or ""
-    except PlaywrightTimeoutError:
-        body_text = ""
+        # Probe every selector in a single round-trip to the browser.
+        matches = page.evaluate(SELECTOR_PRESENCE_JS, CHALLENGE_SELECTORS)
+    except Exception:
+        matches = [False] * len(CHALLENGE_SELECTORS)
 
-    lowered = body_text.lower()
-    if "two-factor" in lowered or "verification code" in lowered:
+    if any(matches[: len(TWO_FACTOR_SELECTORS)]):
         return "Two-factor authentication challenge detected."
-    if "captcha" in lowered:
+    if any(matches[len(TWO_FACTOR_SELECTORS) :]):
+        return "CAPTCHA challenge detected."
+
+    snippet = body_snippet(page)
+    if TWO_FACTOR_TEXT_PATTERN.search(snippet):
+        return "Two-factor authentication challenge detected."
+    if "captcha" in snippet:
         return "CAPTCHA challenge detected."
 
     return None
 
 
+def body_snippet(page) -> str:
+    """Return the lowercased start of the page text, capped in the browser."""
+    try:
+        return page.evaluate(BODY_SNIPPET_JS) or ""
+    except Exception:
+        return ""
+
+
 def login_successful(page) -> bool:
     url = page.url.lower()
     if "clientarea" in url and "login" not in url:
         return True
 
-    logout_selectors = (
-        "a[href*='logout']",
-        "text=Logout",
-        "text=Log Out",
-    )
-
-    for selector in logout_selectors:
-        try:
-            if page.locator(selector).count() > 0:
-                return True
-        except Exception:
-            continue
-
-    return False
+    try:
+        return bool(page.evaluate(LOGOUT_PRESENT_JS))
+    except Exception:
+        return False
 
 
 if __name__ == "__main__":